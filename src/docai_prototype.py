@@ -1,6 +1,6 @@
 """Small prototype for using Google Document AI to parse PDFs and output structured JSONL.
 
-This script is intentionally minimal and synchronous for small PDFs. It expects the environment variable GOOGLE_APPLICATION_CREDENTIALS to point to a service account JSON key with permission to call the Document AI processor you create in your Google Cloud project. It also expects the environment variable DOCAI_PROCESSOR_NAME to be set to the full resource name of your processor, e.g.:
+This script sends PDFs to the processor's online endpoint concurrently (large PDFs are split into page chunks), or to the batch API with --batch. It expects the environment variable GOOGLE_APPLICATION_CREDENTIALS to point to a service account JSON key with permission to call the Document AI processor you create in your Google Cloud project. It also expects the environment variable DOCAI_PROCESSOR_NAME to be set to the full resource name of your processor, e.g.:
   projects/PROJECT_ID/locations/LOCATION/processors/PROCESSOR_ID
 
 Usage (example):
@@ -9,15 +9,23 @@ Usage (example):
     --out data/processed/docai_example.jsonl
 
 Notes:
-- For large or many PDFs, use the async/batch API. This script uses the synchronous `process_document`
-  method which is fine for small PDFs.
+- By default this script calls the online `process_document` method through the asyncio client,
+  with many requests in flight. For many PDFs, use the batch API instead. Local inputs are uploaded to --gcs-staging first
+  (or pass --gcs-input for PDFs already in GCS):
+    python -m src.docai_prototype --batch --input data/raw/rag_pdfs.tsv \
+      --gcs-staging gs://BUCKET/papers/ --gcs-output gs://BUCKET/docai-output/ \
+      --output data/processed/docai_batch.jsonl
 """
 from __future__ import annotations
 
+import hashlib
 import json
 import logging
+import re
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Optional, Dict, Any, List, Tuple
+from functools import partial
+from typing import Optional, Dict, Any, Callable, Iterable, List, Tuple, Union
 from pathlib import Path
 import os
 from dotenv import load_dotenv
@@ -25,55 +33,243 @@ import argparse
 from tqdm import tqdm
 import pandas as pd
 import io
+import numpy as np
+import asyncio
+import threading
+from collections import deque
+from itertools import islice, repeat
+from concurrent.futures import ThreadPoolExecutor
 from pypdf import PdfReader, PdfWriter
+# pikepdf (qpdf) slices page ranges several times faster than pypdf; pypdf is the fallback.
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
 
+from google.api_core.client_options import ClientOptions
 from google.cloud import documentai_v1 as documentai
+from google.protobuf.field_mask_pb2 import FieldMask
+
+# orjson is several times faster than the stdlib encoder and emits UTF-8 bytes directly;
+# fall back to json if it isn't installed.
+try:
+    from orjson import dumps as _json_dumps
+except ImportError:
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+# The JSONL schema is fixed, so lines are filled into bytes templates from separately
+# encoded values instead of building and encoding a dict per block.
+_LINE_TEMPLATE = b'{"page":%d,"text":%s,"metadata":%s}\n'
+_BBOX_LINE_TEMPLATE = b'{"page":%d,"bbox":%s,"text":%s,"metadata":%s}\n'
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s %(levelname)s %(message)s")
 
 load_dotenv()
 
-@dataclass
+# Page-range chunks of a PDF are sent concurrently (from threads in process_pdf, as tasks
+# in process_pdf_async), but only as a short lookahead, since everything past the
+# References section is thrown away. In-flight requests are capped by a semaphore to stay
+# within the processor's quota.
+MAX_CHUNK_WORKERS = 2
+MAX_CONCURRENT_REQUESTS = 16
+
+# Document AI online processing rejects files over 20 MB; larger PDFs are split into page
+# ranges first, but a range that is still too big is refused before it is sent.
+MAX_PDF_BYTES = 20 * 1024 * 1024
+_REQUEST_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+# Only these parts of a Document are read (see _blocks_from_document); asking for just them
+# keeps page images, tokens, form fields, etc. out of the response. Document AI only accepts
+# top-level and pages.<field> paths here.
+_FIELD_MASK = FieldMask(paths=["text", "pages.page_number", "pages.blocks", "pages.paragraphs", "pages.lines"])
+
+# Parsed Documents are cached on disk by processor and PDF (chunk) content hash, so
+# reruns over the same PDFs don't pay for the same pages again.
+DOCAI_CACHE_DIR = Path.home() / ".cache" / "docai"
+
+# The generated gRPC transports already lift the message size limits; keepalive pings keep
+# the connection from being dropped while idle between PDFs in long runs.
+_GRPC_CHANNEL_OPTIONS = [("grpc.keepalive_time_ms", 30000)]
+
+_CLIENTS: Dict[Tuple[str, str], documentai.DocumentProcessorServiceClient] = {}
+_CLIENT_LOCK = threading.Lock()
+
+
+def _get_client(processor_name: str, transport: str="grpc") -> documentai.DocumentProcessorServiceClient:
+    """Return the shared Document AI client for `transport` ("grpc" or "rest") and the processor's
+    regional endpoint, creating it on first use.
+
+    The client owns the channel and the cached credentials, so reusing it across PDFs and
+    chunks avoids a new connection and token lookup per file. It talks to the regional
+    endpoint of the processor's location.
+    """
+    options = _client_options(processor_name)
+    key = (transport, options.api_endpoint)
+    with _CLIENT_LOCK:
+        if key not in _CLIENTS:
+            _CLIENTS[key] = documentai.DocumentProcessorServiceClient(client_options=options, transport=_transport(transport))
+    return _CLIENTS[key]
+
+
+def _client_options(processor_name: str) -> ClientOptions:
+    location = documentai.DocumentProcessorServiceClient.parse_processor_path(processor_name)["location"]
+    return ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
+
+
+def _transport(name: str):
+    """Client `transport` argument: "rest" as is, or a gRPC transport factory whose channel
+    also gets _GRPC_CHANNEL_OPTIONS."""
+    if name == "rest":
+        return name
+    transport_cls = documentai.DocumentProcessorServiceClient.get_transport_class(name)
+
+    def create_channel(host, options=(), **kwargs):
+        return transport_cls.create_channel(host, options=[*options, *_GRPC_CHANNEL_OPTIONS], **kwargs)
+
+    return partial(transport_cls, channel=create_channel)
+
+
+class _ThreadedClient:
+    """Stands in for DocumentProcessorServiceAsyncClient over REST, which has no asyncio
+    transport: each process_document call runs the sync client in a worker thread.
+
+    The threads come from a pool of its own, sized to MAX_CONCURRENT_REQUESTS: the loop's
+    default executor is smaller on most machines and is also where PDF slicing, cache I/O
+    and block building run, which shouldn't queue behind HTTP calls.
+    """
+
+    def __init__(self, client: documentai.DocumentProcessorServiceClient):
+        self._client = client
+        self._executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS, thread_name_prefix="docai-rest")
+
+    async def process_document(self, request):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(self._client.process_document, request=request))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._client.transport.close()
+
+@dataclass(slots=True)
 class Block:
     page: int
-    bbox: List[Dict[str, float]]
+    bbox: Optional[np.ndarray]  # (n_vertices, 2) float32 array of normalized (x, y); None unless keep_bbox
     text: str
     doc: str
     metadata: Optional[Dict[str, Any]] = None
 
 
 def get_text_for_anchor(document: documentai.Document, text_anchor) -> str:
-    if not text_anchor or not getattr(text_anchor, "text_segments", None):
+    return _text_for_anchor(document.text, text_anchor)
+
+
+def _text_for_anchor(text: str, text_anchor) -> str:
+    segments = getattr(text_anchor, "text_segments", None) if text_anchor else None
+    if not segments:
         return ""
-    out = []
-    for seg in text_anchor.text_segments:
-        start_idx = int(seg.start_index or 0)
-        end_idx = int(seg.end_index)
-        out.append(document.text[start_idx:end_idx])
-    return "".join(out)
+    # unset indices read as 0, so no `or 0` needed
+    if len(segments) == 1:
+        # the usual case for blocks: one contiguous span, no join needed
+        return text[segments[0].start_index:segments[0].end_index]
+    return "".join([text[seg.start_index:seg.end_index] for seg in segments])
 
 
-def process_small_pdf(client, processor_name: str, pdf_name: str, pdf_bytes, metadata=None, page_offset: int=0) -> Tuple[List[Block], bool]:
+def process_small_pdf(client, processor_name: str, pdf_name: str, pdf_bytes, metadata=None, page_offset: int=0, keep_bbox: bool=False, use_cache: bool=True) -> Tuple[List[Block], bool]:
     """Process a PDF via Document AI sync API and return ordered blocks.
 
-    Returns a list of Block(page, bbox, text). Bbox is normalized vertices list.
+    Returns a list of Block(page, bbox, text). Bbox is an array of normalized vertices, or
+    None unless `keep_bbox` is set. With `use_cache`, a Document cached for the same bytes
+    is reused instead of calling the API.
     """
     # with open(pdf_path, "rb") as f:
     #     pdf_bytes = f.read()
 
+    cache_path, doc = _lookup_cache(processor_name, pdf_name, pdf_bytes) if use_cache else (None, None)
+    if doc is None:
+        request = _process_request(processor_name, pdf_name, pdf_bytes)
+        logger.info(f"Sending {pdf_name} to Document AI processor {processor_name}")
+        with _REQUEST_SLOTS:
+            doc = client.process_document(request=request).document
+        if use_cache:
+            _store_document(cache_path, doc)
+    return _blocks_from_result(doc, pdf_name, metadata, page_offset, keep_bbox)
+
+
+async def process_small_pdf_async(client: documentai.DocumentProcessorServiceAsyncClient, processor_name: str, pdf_name: str, pdf_bytes, sem: asyncio.Semaphore, metadata=None, page_offset: int=0, keep_bbox: bool=False, use_cache: bool=True) -> Tuple[List[Block], bool]:
+    """Async counterpart of process_small_pdf; `sem` bounds the requests in flight.
+
+    Hashing for the cache key, cache I/O and block building run in worker threads so they
+    don't stall the event loop.
+    """
+    cache_path, doc = await asyncio.to_thread(_lookup_cache, processor_name, pdf_name, pdf_bytes) if use_cache else (None, None)
+    if doc is None:
+        request = _process_request(processor_name, pdf_name, pdf_bytes)
+        logger.info(f"Sending {pdf_name} to Document AI processor {processor_name}")
+        async with sem:
+            doc = (await client.process_document(request=request)).document
+        if use_cache:
+            await asyncio.to_thread(_store_document, cache_path, doc)
+    return await asyncio.to_thread(_blocks_from_result, doc, pdf_name, metadata, page_offset, keep_bbox)
+
+
+def _process_request(processor_name: str, pdf_name: str, pdf_bytes: bytes) -> Dict[str, Any]:
+    if len(pdf_bytes) > MAX_PDF_BYTES:
+        raise ValueError(f"{pdf_name} is {len(pdf_bytes)} bytes, over the {MAX_PDF_BYTES}-byte Document AI online limit")
     raw_doc = {"content": pdf_bytes, "mime_type": "application/pdf"}
-    request = {"name": processor_name, "raw_document": raw_doc}
+    return {"name": processor_name, "raw_document": raw_doc, "field_mask": _FIELD_MASK}
 
-    logger.info(f"Sending {pdf_name} to Document AI processor {processor_name}")
-    result = client.process_document(request=request)
-    doc = result.document
 
-    blocks: List[Block] = []
+def _cache_path(processor_name: str, pdf_bytes: bytes) -> Path:
+    processor_id = processor_name.rsplit("/", 1)[-1]
+    # the field mask is part of the key, so widening it doesn't reuse trimmed Documents
+    key = hashlib.sha256(pdf_bytes)
+    key.update(",".join(_FIELD_MASK.paths).encode())
+    return DOCAI_CACHE_DIR / f"{processor_id}_{key.hexdigest()}.pb"
+
+
+def _lookup_cache(processor_name: str, pdf_name: str, pdf_bytes: bytes) -> Tuple[Path, Optional[documentai.Document]]:
+    cache_path = _cache_path(processor_name, pdf_bytes)
+    return cache_path, _load_cached_document(cache_path, pdf_name)
+
+
+def _load_cached_document(cache_path: Path, pdf_name: str) -> Optional[documentai.Document]:
+    try:
+        data = cache_path.read_bytes()
+    except FileNotFoundError:
+        return None
+    logger.info(f"Using cached Document AI result for {pdf_name} ({cache_path.name})")
+    return documentai.Document.deserialize(data)
+
+
+def _store_document(cache_path: Path, doc: documentai.Document):
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # write then rename, so a concurrent reader or a crash never sees a partial file
+    tmp = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(documentai.Document.serialize(doc))
+    os.replace(tmp, cache_path)
+
+
+def _blocks_from_result(doc: documentai.Document, pdf_name: str, metadata, page_offset: int, keep_bbox: bool) -> Tuple[List[Block], bool]:
     num_pages = len(doc.pages)
     logger.info(f"Document AI returned {num_pages} pages for {pdf_name}")
 
-    for p in doc.pages:
+    blocks = _blocks_from_document(doc, pdf_name, metadata=metadata, page_offset=page_offset, keep_bbox=keep_bbox)
+    return _truncate_at_references(blocks, pdf_name)
+
+def _blocks_from_document(doc: documentai.Document, pdf_name: str, metadata=None, page_offset: int=0, keep_bbox: bool=False) -> List[Block]:
+    """Turn the pages of a Document AI Document (or one shard of it) into Blocks."""
+    # Walk the underlying protobuf message: every field access through the proto-plus
+    # wrappers costs ~10x more, which dominates this loop on large documents.
+    pb_doc = documentai.Document.pb(doc)
+    doc_text = pb_doc.text
+    page_nums: List[int] = []
+    candidates = []
+    for p in pb_doc.pages:
         # Document AI returns page_number starting at 1 for the returned document. If we
         # processed a chunk of the original PDF, apply a page_offset to map to the
         # original global page numbers.
@@ -81,19 +277,27 @@ def process_small_pdf(client, processor_name: str, pdf_name: str, pdf_bytes, met
         page_num = int(page_offset) + local_page_num
         
         # Use blocks and paragraphs where available, fallback to lines
-        candidates = list(p.blocks or [])
-        if not candidates:
+        page_candidates = list(p.blocks or [])
+        if not page_candidates:
             logger.warning(f"No blocks found on page {page_num} of {pdf_name}, falling back to paragraphs")
-            candidates = list(p.paragraphs or [])
-        if not candidates:
+            page_candidates = list(p.paragraphs or [])
+        if not page_candidates:
             logger.warning(f"No paragraphs found on page {page_num} of {pdf_name}, falling back to lines")
-            candidates = list(p.lines or [])
+            page_candidates = list(p.lines or [])
+
+        page_nums.extend(repeat(page_num, len(page_candidates)))
+        candidates.extend(page_candidates)
+
+    bboxes = repeat(None)
+    if keep_bbox:
+        xy, counts = _pack_bboxes([b.layout.bounding_poly.normalized_vertices for b in candidates])
+        ends = np.cumsum(counts)
+        bboxes = [xy[start:end] for start, end in zip((ends - counts).tolist(), ends.tolist())]
 
-        for b in candidates:
-            text = get_text_for_anchor(doc, b.layout.text_anchor)
-            verts = getattr(b.layout.bounding_poly, "normalized_vertices", []) or []
-            bbox = [_vertex_to_dict(v) for v in verts]
-            blocks.append(Block(page=page_num, bbox=bbox, text=text, metadata=metadata, doc=pdf_name))
+    blocks = [
+        Block(page=page_num, bbox=bbox, text=_text_for_anchor(doc_text, b.layout.text_anchor), metadata=metadata, doc=pdf_name)
+        for page_num, b, bbox in zip(page_nums, candidates, bboxes)
+    ]
 
     # # Sort by page, top->left using bbox centroid
     # def centroid_yx(bb):
@@ -103,6 +307,20 @@ def process_small_pdf(client, processor_name: str, pdf_name: str, pdf_bytes, met
 
     # blocks.sort(key=lambda b: (b.page, *centroid_yx(b.bbox)))
 
+    return blocks
+
+
+def _pack_bboxes(polys) -> Tuple[np.ndarray, np.ndarray]:
+    """Pack the normalized vertices of all `polys` into one (total_vertices, 2) float32 array.
+
+    Returns the array and the number of vertices of each poly, so each block's bbox can be a
+    view into it instead of a separate allocation.
+    """
+    counts = np.fromiter(map(len, polys), dtype=np.intp, count=len(polys))
+    xy = np.fromiter((c for verts in polys for v in verts for c in (v.x, v.y)), dtype=np.float32, count=2 * int(counts.sum()))
+    return xy.reshape(-1, 2), counts
+
+def _truncate_at_references(blocks: List[Block], pdf_name: str) -> Tuple[List[Block], bool]:
     (idx, ref_found) = _look_for_references_block(blocks)
     if ref_found:
         logger.info(f"Found References section starting at block index {idx} in document {pdf_name}")
@@ -112,74 +330,351 @@ def process_small_pdf(client, processor_name: str, pdf_name: str, pdf_bytes, met
 
     return (blocks, ref_found)
 
-def _vertex_to_dict(v):
-    return {"x": float(v.x), "y": float(v.y)}
+# a References/Bibliography heading, optionally numbered ("7 References", "7. Bibliography"),
+# standing alone on the block's first line
+_REFERENCES_HEADING = re.compile(r"(?:\d+\.?\s*)?(?:references|bibliography)\b[ \t:]*(?:\n|$)", re.IGNORECASE)
+
 
 def _look_for_references_block(blocks: List[Block]):
     """Heuristic to find the start of the References section in a list of Blocks.
 
-    Returns the index of the block that starts the References section, or None if not found.
+    Returns (index, True) for the first block that starts with a References heading, or
+    (-1, False) if there is none. In-body mentions like "References to prior work..." don't count.
     """
-    idx = -1
-    found = False
     for i, b in enumerate(blocks):
-        if b.text.strip().lower() in ("references", "bibliography"):
-            idx = i
-        if b.text.strip().lower().startswith("references\n") or b.text.strip().lower().startswith("bibliography\n"):
-            idx = i
-        if "references" in b.text.strip().lower()[:20] or "bibliography" in b.text.strip().lower()[:20]:
-            idx = i
-    if idx != -1:
-        found = True
-    return (idx, found)
+        if _REFERENCES_HEADING.match(b.text.strip()):
+            return (i, True)
+    return (-1, False)
+
+
+def _open_pdf(pdf_path: Path):
+    return pikepdf.open(pdf_path) if pikepdf is not None else PdfReader(str(pdf_path))
+
+
+def _iter_chunks(src, maxpages: int):
+    """Yield (start, pdf_bytes) for consecutive `maxpages`-page ranges of `src` (from _open_pdf).
+
+    Each range is only sliced and serialized when the caller asks for it, so pages after
+    the point where the caller stops are never touched.
+    """
+    # look the page list up once; both backends slice it without copying pages
+    pages = src.pages
+    for start in range(0, len(pages), maxpages):
+        chunk_pages = pages[start:start + maxpages]
+        buf = io.BytesIO()
+        if pikepdf is not None:
+            dst = pikepdf.Pdf.new()
+            for page in chunk_pages:
+                dst.pages.append(page)
+            # no recompression: Document AI decodes the streams anyway
+            dst.save(buf, linearize=False, compress_streams=False, deterministic_id=True)
+        else:
+            writer = PdfWriter()
+            for page in chunk_pages:
+                writer.add_page(page)
+            writer.write(buf)
+        yield start, buf.getvalue()
 
 
-def process_pdf(processor_name: str, pdf_path: Path, metadata: Optional[Dict[str, Any]]=None, maxpages: int=15) -> List[Block]:
+def process_pdf(processor_name: str, pdf_path: Path, metadata: Optional[Dict[str, Any]]=None, maxpages: int=15, client: Optional[documentai.DocumentProcessorServiceClient]=None, keep_bbox: bool=False, use_cache: bool=True) -> List[Block]:
 
     # If the PDF is large, some Document AI sync endpoints may fail; for robustness,
     # split into chunks of up to `maxpages` pages and call the API per chunk when necessary.
 
-    client = documentai.DocumentProcessorServiceClient()
+    client = client or _get_client(processor_name)
 
-    reader = PdfReader(str(pdf_path))
-    page_count = len(reader.pages)
-    logger.info(f"PDF {pdf_path} has {page_count} pages")
+    with _open_pdf(pdf_path) as src:
+        page_count = len(src.pages)
+        logger.info(f"PDF {pdf_path} has {page_count} pages")
  
-    if page_count <= maxpages:
-        with open(pdf_path, "rb") as f:
-            pdf_bytes = f.read()
-        blocks, _ = process_small_pdf(client=client, processor_name=processor_name, pdf_name=pdf_path.name, pdf_bytes=pdf_bytes, metadata=metadata)
-    elif page_count > maxpages:
-        logger.info("Large PDF (%d pages) detected; splitting into chunks of up to %d pages", page_count, maxpages)
+        if page_count <= maxpages:
+            with open(pdf_path, "rb") as f:
+                pdf_bytes = f.read()
+            blocks, _ = process_small_pdf(client=client, processor_name=processor_name, pdf_name=pdf_path.name, pdf_bytes=pdf_bytes, metadata=metadata, keep_bbox=keep_bbox, use_cache=use_cache)
+        elif page_count > maxpages:
+            logger.info("Large PDF (%d pages) detected; splitting into chunks of up to %d pages", page_count, maxpages)
+
+            # chunks are sliced lazily on this thread (neither pikepdf nor pypdf objects are
+            # safe to share across threads) and at most MAX_CHUNK_WORKERS are in flight. Results
+            # are consumed in page order, so once References is found nothing after it is sliced
+            # or sent, and any chunk still queued is cancelled.
+            chunks = _iter_chunks(src, maxpages)
+            pending = deque()
+            blocks: List[Block] = []
+            with ThreadPoolExecutor(max_workers=MAX_CHUNK_WORKERS) as ex:
+
+                def submit_next():
+                    for start, pdf_bytes in islice(chunks, 1):
+                        # Pass page_offset=start so returned page numbers are mapped to global pages
+                        pending.append((start, ex.submit(process_small_pdf, client=client, processor_name=processor_name, pdf_name=pdf_path.name, pdf_bytes=pdf_bytes, metadata=metadata, page_offset=start, keep_bbox=keep_bbox, use_cache=use_cache)))
+
+                for _ in range(MAX_CHUNK_WORKERS):
+                    submit_next()
+                try:
+                    while pending:
+                        start, fut = pending.popleft()
+                        new_blocks, ref_found = fut.result()
+                        blocks.extend(new_blocks)
+                        if ref_found:
+                            logger.info(f"Stopping early at chunk starting page {start+1} due to References section")
+                            break
+                        submit_next()
+                finally:
+                    for _, fut in pending:
+                        fut.cancel()
+    
+    return blocks
 
+async def process_pdf_async(client: documentai.DocumentProcessorServiceAsyncClient, processor_name: str, pdf_path: Path, sem: asyncio.Semaphore, metadata: Optional[Dict[str, Any]]=None, maxpages: int=15, keep_bbox: bool=False, use_cache: bool=True) -> List[Block]:
+    """Async counterpart of process_pdf, with the same chunking and early stop at References.
+
+    Chunk requests are awaited on the event loop instead of threads; `sem` is shared by all
+    PDFs to bound the requests in flight. Opening, reading, slicing and closing the PDF run
+    in worker threads.
+    """
+    src = await asyncio.to_thread(_open_pdf, pdf_path)
+    try:
+        page_count = await asyncio.to_thread(lambda: len(src.pages))
+        logger.info(f"PDF {pdf_path} has {page_count} pages")
+
+        if page_count <= maxpages:
+            pdf_bytes = await asyncio.to_thread(pdf_path.read_bytes)
+            blocks, _ = await process_small_pdf_async(client, processor_name, pdf_path.name, pdf_bytes, sem, metadata=metadata, keep_bbox=keep_bbox, use_cache=use_cache)
+            return blocks
+
+        logger.info("Large PDF (%d pages) detected; splitting into chunks of up to %d pages", page_count, maxpages)
+        chunks = _iter_chunks(src, maxpages)
+        pending = deque()
         blocks: List[Block] = []
-        # iterate chunks and process each as an in-memory PDF
-        for start in range(0, page_count, maxpages):
-            end = min(start + maxpages, page_count)
-            writer = PdfWriter()
-            for i in range(start, end):
-                writer.add_page(reader.pages[i])
-            buf = io.BytesIO()
-            writer.write(buf)
-            buf.seek(0)
-            pdf_bytes = buf.read()
-            # Pass page_offset=start so returned page numbers are mapped to global pages
-            new_blocks, ref_found = process_small_pdf(client=client, processor_name=processor_name, pdf_name=pdf_path.name, pdf_bytes=pdf_bytes, metadata=metadata, page_offset=start)
-            blocks.extend(new_blocks)
-            if ref_found:
-                logger.info(f"Stopping early at chunk starting page {start+1} due to References section")
-                break
-    
+
+        async def submit_next():
+            # slices are cut one at a time, so the PDF is never touched by two threads at once
+            for start, pdf_bytes in await asyncio.to_thread(list, islice(chunks, 1)):
+                pending.append((start, asyncio.create_task(process_small_pdf_async(client, processor_name, pdf_path.name, pdf_bytes, sem, metadata=metadata, page_offset=start, keep_bbox=keep_bbox, use_cache=use_cache))))
+
+        try:
+            for _ in range(MAX_CHUNK_WORKERS):
+                await submit_next()
+            while pending:
+                start, task = pending.popleft()
+                new_blocks, ref_found = await task
+                blocks.extend(new_blocks)
+                if ref_found:
+                    logger.info(f"Stopping early at chunk starting page {start+1} due to References section")
+                    break
+                await submit_next()
+        finally:
+            for _, task in pending:
+                task.cancel()
+            await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
+    finally:
+        await asyncio.to_thread(src.close)
+
+    return blocks
+
+
+async def _process_all_async(processor_name: str, inputs: List[Tuple[Path, Optional[Dict[str, Any]]]], write: Callable[[List[Block]], int], keep_bbox: bool=False, use_cache: bool=True, transport: str="grpc") -> List[Union[int, BaseException]]:
+    """Run process_pdf_async over (pdf path, metadata) pairs on one async client.
+
+    Each PDF's blocks are handed to `write` (see _open_jsonl) as soon as it finishes, so
+    output is in completion order and blocks aren't kept. Returns one entry per input, in
+    input order: the number of blocks written, or the exception it raised.
+    """
+    sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    # PDFs are opened (and small ones read whole) before their requests wait on `sem`,
+    # so also cap how many are open at once
+    open_pdfs = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    # write() encodes and writes a whole PDF, so it runs in a thread; the lock keeps the
+    # lines of different PDFs from interleaving
+    write_lock = asyncio.Lock()
+    n_failed = 0
+    if transport == "rest":
+        async_client = _ThreadedClient(documentai.DocumentProcessorServiceClient(client_options=_client_options(processor_name), transport="rest"))
+    else:
+        async_client = documentai.DocumentProcessorServiceAsyncClient(client_options=_client_options(processor_name), transport=_transport("grpc_asyncio"))
+    async with async_client as client:
+        with tqdm(total=len(inputs), desc="PDFs") as pbar:
+
+            async def run(pdf: Path, metadata):
+                nonlocal n_failed
+                try:
+                    async with open_pdfs:
+                        blocks = await process_pdf_async(client, processor_name, pdf, sem, metadata=metadata, keep_bbox=keep_bbox, use_cache=use_cache)
+                    async with write_lock:
+                        return await asyncio.to_thread(write, blocks)
+                except Exception:
+                    logger.exception("Failed to process %s", pdf)
+                    n_failed += 1
+                    pbar.set_postfix(failed=n_failed)
+                    raise
+                finally:
+                    pbar.update()
+
+            return await asyncio.gather(*(run(pdf, metadata) for pdf, metadata in inputs), return_exceptions=True)
+
+
+def _split_gcs_uri(uri: str) -> Tuple[str, str]:
+    bucket, _, prefix = uri.removeprefix("gs://").partition("/")
+    return bucket, prefix
+
+
+def upload_pdfs_to_gcs(pdfs: List[Path], gcs_prefix: str, max_workers: int=8) -> List[str]:
+    """Upload local PDFs under a gs:// prefix (in parallel) and return their gs:// URIs, in order."""
+    # google-cloud-storage is only needed for the batch API
+    from google.cloud import storage
+
+    bucket_name, prefix = _split_gcs_uri(gcs_prefix)
+    prefix = prefix.rstrip("/") + "/" if prefix else ""
+    # key each blob by its resolved local path so PDFs sharing a basename don't overwrite each other
+    names = [
+        f"{prefix}{hashlib.sha256(str(pdf.resolve()).encode()).hexdigest()[:16]}/{pdf.name}"
+        for pdf in pdfs
+    ]
+    _check_unique_uris(f"gs://{bucket_name}/{name}" for name in names)
+    bucket = storage.Client().bucket(bucket_name)
+
+    def upload(pdf: Path, name: str) -> str:
+        blob = bucket.blob(name)
+        blob.upload_from_filename(str(pdf), content_type="application/pdf")
+        return f"gs://{bucket_name}/{blob.name}"
+
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        return list(tqdm(ex.map(upload, pdfs, names), total=len(pdfs), desc="Uploading"))
+
+
+def _check_unique_uris(uris: Iterable[str]) -> None:
+    """Raise ValueError if any gs:// URI repeats (batch results and metadata are keyed by URI)."""
+    seen, dupes = set(), set()
+    for uri in uris:
+        (dupes if uri in seen else seen).add(uri)
+    if dupes:
+        raise ValueError(f"Duplicate input documents: {', '.join(sorted(dupes))}")
+
+
+def process_pdfs_batch(processor_name: str, gcs_input: Union[str, List[str]], gcs_output_prefix: str, metadata_by_uri: Optional[Dict[str, Dict[str, Any]]]=None, timeout: int=1800, keep_bbox: bool=False, transport: str="grpc") -> List[Block]:
+    """Process many PDFs in GCS with the Document AI batch API.
+
+    `gcs_input` is either a gs:// prefix (every PDF under it is processed) or a list of
+    gs:// URIs. Unlike process_pdf, all documents go out in a single long-running
+    operation that Document AI fans out server-side. Results are written to
+    `gcs_output_prefix` as (possibly sharded) Document JSON, which is downloaded and
+    turned into Blocks. `metadata_by_uri` attaches metadata to each input document's blocks.
+    """
+    client = _get_client(processor_name, transport)
+
+    if isinstance(gcs_input, str):
+        input_config = documentai.BatchDocumentsInputConfig(
+            gcs_prefix=documentai.GcsPrefix(gcs_uri_prefix=gcs_input)
+        )
+    else:
+        _check_unique_uris(gcs_input)
+        input_config = documentai.BatchDocumentsInputConfig(
+            gcs_documents=documentai.GcsDocuments(
+                documents=[documentai.GcsDocument(gcs_uri=uri, mime_type="application/pdf") for uri in gcs_input]
+            )
+        )
+
+    request = documentai.BatchProcessRequest(
+        name=processor_name,
+        input_documents=input_config,
+        document_output_config=documentai.DocumentOutputConfig(
+            gcs_output_config=documentai.DocumentOutputConfig.GcsOutputConfig(gcs_uri=gcs_output_prefix, field_mask=_FIELD_MASK)
+        ),
+    )
+
+    operation = client.batch_process_documents(request=request)
+    logger.info("Waiting for batch operation %s", operation.operation.name)
+    operation.result(timeout=timeout)
+
+    op_metadata = documentai.BatchProcessMetadata(operation.metadata)
+    if op_metadata.state != documentai.BatchProcessMetadata.State.SUCCEEDED:
+        raise RuntimeError(f"Batch processing failed: {op_metadata.state_message}")
+
+    from google.cloud import storage
+
+    storage_client = storage.Client()
+    blocks: List[Block] = []
+    for status in op_metadata.individual_process_statuses:
+        pdf_name = status.input_gcs_source.rsplit("/", 1)[-1]
+        if not status.output_gcs_destination:
+            logger.warning("No output for %s: %s", status.input_gcs_source, status.status.message)
+            continue
+
+        # Large documents are split into shards; text anchors are relative to each shard's text.
+        # The destination ends in the document's index with no trailing slash, so add one:
+        # otherwise document 1's prefix ".../1" also lists the shards of documents 10, 11, ...
+        bucket, prefix = _split_gcs_uri(status.output_gcs_destination)
+        prefix = prefix.rstrip("/") + "/"
+        shards = [
+            documentai.Document.from_json(blob.download_as_bytes(), ignore_unknown_fields=True)
+            for blob in storage_client.list_blobs(bucket, prefix=prefix)
+            if blob.name.endswith(".json")
+        ]
+        shards.sort(key=lambda d: int(d.shard_info.shard_index))
+        logger.info("Batch output for %s has %d shard(s)", pdf_name, len(shards))
+
+        metadata = (metadata_by_uri or {}).get(status.input_gcs_source)
+        doc_blocks: List[Block] = []
+        for shard in shards:
+            doc_blocks.extend(_blocks_from_document(shard, pdf_name, metadata=metadata, keep_bbox=keep_bbox))
+        doc_blocks, _ = _truncate_at_references(doc_blocks, pdf_name)
+        blocks.extend(doc_blocks)
+
     return blocks
 
+@contextmanager
+def _open_jsonl(out_path: Path, write_bbox: bool=False):
+    """Open `out_path` for JSONL output and yield a `write(blocks) -> int` callable.
+
+    Each call appends its blocks right away, so callers can write one PDF at a time instead
+    of holding every block in memory. Lines go to a temporary file that replaces `out_path`
+    only when the block exits cleanly, so a failed run leaves the previous output in place.
+    """
+    # all blocks of a PDF share one metadata dict, so encode each distinct dict once (the
+    # cache also holds the dict itself, so its id can't be reused while we run) and splice
+    # the bytes into each line
+    meta_cache: Dict[int, Tuple[Any, bytes]] = {}
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    try:
+        with tmp_path.open("wb", buffering=1 << 20) as fh:
+
+            def write(blocks: Iterable[Block]) -> int:
+                n = 0
+                fh_write, dumps = fh.write, _json_dumps
+                for b in blocks:
+                    cached = meta_cache.get(id(b.metadata))
+                    if cached is None:
+                        cached = meta_cache[id(b.metadata)] = (b.metadata, dumps(b.metadata))
+                    if write_bbox:
+                        # blocks built without keep_bbox carry no polygon; write it as null
+                        bbox = b"null" if b.bbox is None else dumps([{"x": x, "y": y} for x, y in b.bbox.tolist()])
+                        fh_write(_BBOX_LINE_TEMPLATE % (b.page, bbox, dumps(b.text), cached[1]))
+                    else:
+                        fh_write(_LINE_TEMPLATE % (b.page, dumps(b.text), cached[1]))
+                    n += 1
+                return n
+
+            yield write
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, out_path)
+
+
 def blocks_to_jsonl(blocks: List[Block], out_path: Path, write_bbox: bool=False):
-    with out_path.open("w", encoding="utf-8") as fh:
-        for b in blocks:
-            if write_bbox:
-                json.dump({"page": b.page, "bbox": b.bbox, "text": b.text, "metadata": b.metadata}, fh, ensure_ascii=False)
-            else:
-                json.dump({"page": b.page, "text": b.text, "metadata": b.metadata}, fh, ensure_ascii=False)
-            fh.write("\n")
+    with _open_jsonl(out_path, write_bbox=write_bbox) as write:
+        write(blocks)
+
+def _check_pdf(pdf: Path) -> Optional[str]:
+    """Cheap pre-flight check; returns why `pdf` can't be processed, or None if it looks fine."""
+    try:
+        size = pdf.stat().st_size
+    except OSError as e:
+        return e.strerror or str(e)
+    if size == 0:
+        return "file is empty"
+    return None
+
 
 def get_processor_name():
     processor_name = os.environ.get("DOCAI_PROCESSOR_NAME")
@@ -194,40 +689,80 @@ def main():
     p = argparse.ArgumentParser()
     p.add_argument("--input", default='data/raw/papers/2020.emnlp-main.550.pdf', help="Path to input PDF, directory containing PDFs, or TSV file of PDF paths and corresponding metadata")
     p.add_argument("--output", default='data/processed/docai_example.jsonl', help="Output JSONL path")
+    p.add_argument("--batch", action="store_true", help="Use the batch API: process --gcs-input, or upload --input to --gcs-staging first")
+    p.add_argument("--gcs-input", help="gs:// prefix of PDFs already in GCS to batch process (instead of --input)")
+    p.add_argument("--gcs-staging", help="gs:// prefix to upload local --input PDFs to for --batch")
+    p.add_argument("--gcs-output", help="gs:// prefix where the batch API writes its results")
+    p.add_argument("--write-bbox", action="store_true", help="Keep block bounding boxes and write them to the JSONL")
+    p.add_argument("--transport", choices=("grpc", "rest"), default="grpc", help="Document AI API transport")
+    p.add_argument("--no-cache", action="store_true", help=f"Always call Document AI instead of reusing results cached in {DOCAI_CACHE_DIR}")
     args = p.parse_args()
 
+    out = Path(args.output)
+    processor = get_processor_name()
+
+    if args.batch and args.gcs_input:
+        if not args.gcs_output:
+            p.error("--batch requires --gcs-output")
+        blocks = process_pdfs_batch(processor, args.gcs_input, args.gcs_output, keep_bbox=args.write_bbox, transport=args.transport)
+        blocks_to_jsonl(blocks, out, write_bbox=args.write_bbox)
+        logger.info("Wrote %d blocks to %s", len(blocks), out)
+        return
+
     inp = Path(args.input)
     if not inp.exists():
         logger.error("Input not found: %s", inp)
         raise SystemExit(2)
-    out = Path(args.output)
-    
-    processor = get_processor_name()
-    
-    blocks = []
 
+    # (pdf path, metadata) pairs
     if inp.is_dir():
-        pdfs = sorted(inp.glob("*.pdf"))
-        for pdf in tqdm(pdfs, desc="PDFs"):
-            try:
-                blocks.extend(process_pdf(processor_name=processor, pdf_path=Path(pdf)))
-            except Exception as e:
-                print(f"Warning: failed to process {pdf}: {e}")
+        inputs = [(pdf, None) for pdf in sorted(inp.glob("*.pdf"))]
     elif inp.is_file() and inp.suffix.lower() == ".pdf":
-        blocks.extend(process_pdf(processor_name=processor, pdf_path=inp))
+        inputs = [(inp, None)]
     elif inp.is_file() and inp.suffix.lower() == ".tsv":
         file_data = pd.read_csv(inp, sep="\t")
-        for _, row in tqdm(file_data.iterrows(), desc="PDFs"):
-            pdf = row['pdf_path']  # assuming the TSV has a column named 'pdf_path'
-            try:
-                blocks.extend(process_pdf(processor_name=processor, pdf_path=Path(pdf), metadata=row.to_dict()))
-            except Exception as e:
-                print(f"Warning: failed to process pdf {pdf}: {e}")
+        # assuming the TSV has a column named 'pdf_path'; to_dict(orient="records") builds
+        # plain per-row dicts in one pass instead of a Series per row
+        inputs = [(Path(row['pdf_path']), row) for row in file_data.to_dict(orient="records")]
     else:
         raise SystemExit("Input must be a PDF, a folder, or a tsv file with PDFs and metadata")
 
-    blocks_to_jsonl(blocks, out, write_bbox=False)
-    logger.info("Wrote %d blocks to %s", len(blocks), out)
+    # a single PDF fails the run; folders and TSVs skip the PDFs that fail and carry on
+    single_pdf = inp.suffix.lower() == ".pdf"
+
+    # drop files that could only fail, before spending an upload or a request on them
+    checked = []
+    for pdf, metadata in inputs:
+        problem = _check_pdf(pdf)
+        if problem and single_pdf:
+            logger.error("Cannot process %s: %s", pdf, problem)
+            raise SystemExit(1)
+        if problem:
+            logger.warning("Skipping %s: %s", pdf, problem)
+        else:
+            checked.append((pdf, metadata))
+    inputs = checked
+
+    if args.batch:
+        # upload everything, then a single batch operation instead of one request per PDF
+        if not args.gcs_staging or not args.gcs_output:
+            p.error("--batch with a local --input requires --gcs-staging and --gcs-output")
+        uris = upload_pdfs_to_gcs([pdf for pdf, _ in inputs], args.gcs_staging)
+        metadata_by_uri = {uri: metadata for uri, (_, metadata) in zip(uris, inputs)}
+        blocks = process_pdfs_batch(processor, uris, args.gcs_output, metadata_by_uri=metadata_by_uri, keep_bbox=args.write_bbox, transport=args.transport)
+        blocks_to_jsonl(blocks, out, write_bbox=args.write_bbox)
+        n_blocks = len(blocks)
+    else:
+        # stream each PDF's blocks to disk as it finishes instead of collecting them all
+        with _open_jsonl(out, write_bbox=args.write_bbox) as write:
+            results = asyncio.run(_process_all_async(processor, inputs, write, keep_bbox=args.write_bbox, use_cache=not args.no_cache, transport=args.transport))
+            if single_pdf and isinstance(results[0], BaseException):
+                # raising here discards the partial output and exits non-zero
+                raise results[0]
+        # failures were already logged as they happened
+        n_blocks = sum(result for result in results if not isinstance(result, BaseException))
+
+    logger.info("Wrote %d blocks to %s", n_blocks, out)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,40 @@
+import pytest
+
+from src.document_parser import chunk_text, iter_chunks
+
+
+def test_chunk_text_overlapping_windows():
+    text = " ".join(f"w{i}" for i in range(10))
+
+    chunks = chunk_text(text, max_words=4, overlap=1)
+
+    assert chunks == [
+        "w0 w1 w2 w3",
+        "w3 w4 w5 w6",
+        "w6 w7 w8 w9",
+        "w9",
+    ]
+
+
+def test_chunk_text_normalizes_whitespace():
+    text = "  alpha\n\nbeta\tgamma   delta \n"
+
+    assert chunk_text(text, max_words=3, overlap=0) == ["alpha beta gamma", "delta"]
+
+
+def test_chunk_text_empty():
+    assert chunk_text("   \n", max_words=3, overlap=1) == []
+
+
+def test_chunk_text_rejects_overlap_not_smaller_than_max_words():
+    with pytest.raises(ValueError):
+        chunk_text("a b c", max_words=3, overlap=3)
+
+
+@pytest.mark.parametrize("max_words,overlap", [(4, 1), (5, 0), (3, 2), (50, 10)])
+def test_iter_chunks_matches_chunk_text(max_words, overlap):
+    pages = ["a b c d e", "", "f g\nh", "i j k l m n o p", "q"]
+
+    streamed = list(iter_chunks(pages, max_words=max_words, overlap=overlap))
+
+    assert streamed == chunk_text("\n\n".join(pages), max_words=max_words, overlap=overlap)
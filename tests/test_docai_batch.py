@@ -0,0 +1,62 @@
+from unittest import mock
+
+from src import docai_prototype
+from src.docai_prototype import documentai, process_pdfs_batch
+
+PROCESSOR = "projects/p/locations/us/processors/abc"
+
+
+def make_shard(text, shard_index=0):
+    layout = documentai.Document.Page.Layout(
+        text_anchor=documentai.Document.TextAnchor(
+            text_segments=[documentai.Document.TextAnchor.TextSegment(start_index=0, end_index=len(text))]
+        )
+    )
+    return documentai.Document(
+        text=text,
+        pages=[documentai.Document.Page(page_number=1, blocks=[documentai.Document.Page.Block(layout=layout)])],
+        shard_info=documentai.Document.ShardInfo(shard_index=shard_index),
+    )
+
+
+class FakeBlob:
+    def __init__(self, name, doc):
+        self.name = name
+        self._data = documentai.Document.to_json(doc).encode()
+
+    def download_as_bytes(self):
+        return self._data
+
+
+class FakeStorageClient:
+    def __init__(self, blobs):
+        self.blobs = blobs
+
+    def list_blobs(self, bucket, prefix=""):
+        return [b for b in self.blobs if b.name.startswith(prefix)]
+
+
+def run_batch(n_docs):
+    uris = [f"gs://in/papers/doc{i}.pdf" for i in range(n_docs)]
+    statuses = [
+        documentai.BatchProcessMetadata.IndividualProcessStatus(input_gcs_source=uri, output_gcs_destination=f"gs://out/run/42/{i}")
+        for i, uri in enumerate(uris)
+    ]
+    op = mock.Mock()
+    op.metadata = documentai.BatchProcessMetadata(state=documentai.BatchProcessMetadata.State.SUCCEEDED, individual_process_statuses=statuses)
+    client = mock.Mock()
+    client.batch_process_documents.return_value = op
+    blobs = [FakeBlob(f"run/42/{i}/doc{i}-0.json", make_shard(f"text of doc{i}\n")) for i in range(n_docs)]
+    metadata_by_uri = {uri: {"title": f"doc{i}"} for i, uri in enumerate(uris)}
+
+    with mock.patch.object(docai_prototype, "_get_client", return_value=client), \
+            mock.patch("google.cloud.storage.Client", return_value=FakeStorageClient(blobs)):
+        return process_pdfs_batch(PROCESSOR, uris, "gs://out/run/", metadata_by_uri=metadata_by_uri)
+
+
+def test_batch_keeps_each_documents_shards_separate():
+    # with 11+ documents, the output prefix ".../1" is also a prefix of ".../10" and ".../11"
+    blocks = run_batch(12)
+    assert [(b.doc, b.text, b.metadata["title"]) for b in blocks] == [
+        (f"doc{i}.pdf", f"text of doc{i}\n", f"doc{i}") for i in range(12)
+    ]
@@ -0,0 +1,115 @@
+import importlib.util
+import json
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from src import docai_prototype
+from src.docai_prototype import _pack_bboxes, _text_for_anchor, documentai
+
+
+def load_without_orjson(monkeypatch):
+    # a second copy of the module, imported as if orjson weren't installed
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    spec = importlib.util.spec_from_file_location("docai_prototype_stdlib_json", docai_prototype.__file__)
+    module = importlib.util.module_from_spec(spec)
+    monkeypatch.setitem(sys.modules, spec.name, module)
+    spec.loader.exec_module(module)
+    assert module._json_dumps.__module__ == spec.name
+    return module
+
+
+@pytest.fixture(params=["orjson", "json"])
+def dp(request, monkeypatch):
+    return docai_prototype if request.param == "orjson" else load_without_orjson(monkeypatch)
+
+
+def make_blocks(dp):
+    shared = {"title": "Dense “Passage” Retrieval", "year": 2020, "tags": ["rag"], "score": 0.5}
+    return [
+        dp.Block(page=1, bbox=np.array([[0.25, 0.5], [0.75, 0.5]], dtype=np.float32), text='He said "hi"\n\tand left', doc="a.pdf", metadata=shared),
+        dp.Block(page=2, bbox=None, text="ünïcödé — text", doc="a.pdf", metadata=shared),
+        dp.Block(page=3, bbox=np.zeros((0, 2), dtype=np.float32), text="", doc="a.pdf", metadata=None),
+    ]
+
+
+def old_line(b, write_bbox):
+    # the dicts blocks_to_jsonl used to json.dump, one per line
+    if write_bbox:
+        bbox = None if b.bbox is None else [{"x": float(x), "y": float(y)} for x, y in b.bbox]
+        return {"page": b.page, "bbox": bbox, "text": b.text, "metadata": b.metadata}
+    return {"page": b.page, "text": b.text, "metadata": b.metadata}
+
+
+@pytest.mark.parametrize("write_bbox", [False, True])
+def test_blocks_to_jsonl_matches_old_dict_shape(dp, tmp_path, write_bbox):
+    blocks = make_blocks(dp)
+    out = tmp_path / "blocks.jsonl"
+
+    dp.blocks_to_jsonl(blocks, out, write_bbox=write_bbox)
+
+    lines = out.read_bytes().split(b"\n")
+    assert lines[-1] == b""
+    parsed = [json.loads(line) for line in lines[:-1]]
+    assert parsed == [old_line(b, write_bbox) for b in blocks]
+    # same key order as the old dicts too
+    assert [list(d) for d in parsed] == [list(old_line(b, write_bbox)) for b in blocks]
+
+
+def test_open_jsonl_appends_per_call(tmp_path):
+    out = tmp_path / "blocks.jsonl"
+    blocks = make_blocks(docai_prototype)
+
+    with docai_prototype._open_jsonl(out) as write:
+        assert write(blocks[:2]) == 2
+        assert write(blocks[2:]) == 1
+
+    assert [json.loads(line)["page"] for line in out.read_text().splitlines()] == [1, 2, 3]
+
+
+def anchor(*spans):
+    return documentai.Document.TextAnchor(
+        text_segments=[documentai.Document.TextAnchor.TextSegment(start_index=s, end_index=e) for s, e in spans]
+    )
+
+
+@pytest.mark.parametrize(
+    "text_anchor, expected",
+    [
+        (anchor((0, 5)), "Intro"),
+        # segments are concatenated as-is
+        (anchor((0, 6), (12, 16)), "Intro text"),
+        # an unset start_index reads as 0
+        (documentai.Document.TextAnchor(text_segments=[documentai.Document.TextAnchor.TextSegment(end_index=5)]), "Intro"),
+        (documentai.Document.TextAnchor(), ""),
+        (None, ""),
+    ],
+)
+def test_text_for_anchor(text_anchor, expected):
+    assert _text_for_anchor("Intro Dense\ntext", text_anchor) == expected
+
+
+def test_text_for_anchor_on_raw_protobuf():
+    pb_anchor = documentai.Document.TextAnchor.pb(anchor((0, 6), (12, 16)))
+
+    assert _text_for_anchor("Intro Dense\ntext", pb_anchor) == "Intro text"
+
+
+def test_pack_bboxes():
+    v = lambda x, y: SimpleNamespace(x=x, y=y)
+    polys = [[v(0.0, 0.25), v(1.0, 0.25), v(1.0, 0.5), v(0.0, 0.5)], [], [v(0.5, 0.75)]]
+
+    xy, counts = _pack_bboxes(polys)
+
+    assert xy.dtype == np.float32
+    assert counts.tolist() == [4, 0, 1]
+    assert xy.tolist() == [[0.0, 0.25], [1.0, 0.25], [1.0, 0.5], [0.0, 0.5], [0.5, 0.75]]
+
+
+def test_pack_bboxes_empty():
+    xy, counts = _pack_bboxes([])
+
+    assert xy.shape == (0, 2)
+    assert counts.tolist() == []
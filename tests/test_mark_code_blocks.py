@@ -38,3 +38,28 @@ def test_mark_code_blocks_marks_multiline_only():
     # Ensure inline and single-line code are NOT inside the CODEBLOCK region
     assert not (start < inline_idx < end), "inline code was incorrectly wrapped"
     assert not (start < single_idx < end), "single-line code was incorrectly wrapped"
+
+
+def test_mark_code_blocks_marks_nested_code_once():
+    html = """
+    <html>
+      <body>
+        <div class="code"><pre><code>x = 1
+y = 2</code></pre></div>
+        <pre>plain pre block
+second line</pre>
+      </body>
+    </html>
+    """
+
+    soup = BeautifulSoup(html, "html.parser")
+    mark_code_blocks(soup, url="http://example.test")
+
+    text = soup.get_text()
+
+    # one marker pair for the nested div/pre/code block, one for the bare <pre>
+    assert text.count("[CODEBLOCK]") == 2
+    assert text.count("[/CODEBLOCK]") == 2
+    first_end = text.find("[/CODEBLOCK]")
+    assert "x = 1" in text[text.find("[CODEBLOCK]"):first_end]
+    assert "plain pre block" in text[first_end:]
@@ -0,0 +1,30 @@
+import pymupdf
+import pytest
+
+from src.document_parser import PDF_BACKENDS, parse_pdf, parse_pdf_pages
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = tmp_path / "three_pages.pdf"
+    with pymupdf.open() as doc:
+        for i in range(1, 4):
+            doc.new_page().insert_text((72, 72), f"Page {i} text")
+        doc.save(path)
+    return path
+
+
+@pytest.mark.parametrize("backend", PDF_BACKENDS)
+def test_parse_pdf_pages_numbers_pages_from_one(pdf_path, backend):
+    pages = parse_pdf_pages(pdf_path, backend=backend)
+
+    assert [n for n, _ in pages] == [1, 2, 3]
+    assert [t.strip() for _, t in pages] == ["Page 1 text", "Page 2 text", "Page 3 text"]
+
+
+def test_parse_pdf_pages_with_workers_matches_single_process(pdf_path):
+    assert parse_pdf_pages(pdf_path, workers=2) == parse_pdf_pages(pdf_path)
+
+
+def test_parse_pdf_joins_pages(pdf_path):
+    assert parse_pdf(pdf_path) == "\n\n".join(t for _, t in parse_pdf_pages(pdf_path)).strip()
@@ -0,0 +1,40 @@
+import pytest
+
+from src.docai_prototype import Block, _look_for_references_block
+
+
+def make_blocks(texts):
+    return [Block(page=1, bbox=None, text=t, doc="paper.pdf") for t in texts]
+
+
+@pytest.mark.parametrize(
+    "heading",
+    ["References", "  REFERENCES\n", "7 References\n", "Bibliography\n[1] Smith et al.", "References\n[1] Lewis et al. 2020"],
+)
+def test_look_for_references_block_finds_heading(heading):
+    blocks = make_blocks(["Introduction\n", "Some body text about retrieval.\n", heading, "[1] A cited paper.\n"])
+    assert _look_for_references_block(blocks) == (2, True)
+
+
+def test_look_for_references_block_returns_first_match():
+    blocks = make_blocks(["Body\n", "References\n", "[1] Paper.\n", "Bibliography\n"])
+    assert _look_for_references_block(blocks) == (1, True)
+
+
+def test_look_for_references_block_ignores_late_mentions():
+    # "references" in the middle of a sentence is body text, not a heading
+    blocks = make_blocks(["As shown in prior work, references to retrieval abound.\n", "Conclusion\n"])
+    assert _look_for_references_block(blocks) == (-1, False)
+
+
+def test_look_for_references_block_skips_early_in_body_mentions():
+    # a sentence that opens with "References" must not cut the paper short
+    blocks = make_blocks([
+        "Introduction\n",
+        "References to prior work on dense retrieval are collected in Section 2.\n",
+        "2 Bibliography of retrieval methods we compare against\n",
+        "Method\n",
+        "References\n",
+        "[1] A cited paper.\n",
+    ])
+    assert _look_for_references_block(blocks) == (4, True)
@@ -0,0 +1,107 @@
+from unittest import mock
+
+import pytest
+
+from src import document_parser
+from src.document_parser import (
+    _chunk_id,
+    load_manifest,
+    process_url_incremental,
+    write_jsonl,
+    write_manifest,
+)
+
+URL = "https://example.com/post"
+
+
+@pytest.fixture
+def site(monkeypatch):
+    """Stub the network: HEAD returns `site.validators`, scraping returns `site.words`."""
+    state = mock.Mock(validators={"etag": '"v1"'}, words=3, scrapes=0)
+    session = mock.Mock()
+
+    def fake_process_url(url, max_words, overlap, metadata):
+        state.scrapes += 1
+        return [
+            {"id": _chunk_id(url, i), "source": url, "chunk_index": i, "text": f"chunk {i}", "metadata": metadata}
+            for i in range(state.words)
+        ]
+
+    monkeypatch.setattr(document_parser, "_head_validators", lambda url: dict(state.validators))
+    monkeypatch.setattr(document_parser, "process_url", fake_process_url)
+    monkeypatch.setattr(document_parser, "_get_session", lambda: session)
+    state.session = session
+    return state
+
+
+def run(out, metadata=None):
+    # what main() does for a TSV of URLs, minus the thread pool
+    manifest = load_manifest(out)
+    items, entry = process_url_incremental(URL, 250, 50, metadata or {"url": URL}, manifest, out)
+    index = {}
+    write_jsonl(iter(items), out, index=index)
+    write_manifest(out, {URL: entry} if entry else {}, index)
+    return items
+
+
+def test_unchanged_page_reuses_prior_chunks(site, tmp_path):
+    out = tmp_path / "chunks.jsonl"
+    first = run(out)
+
+    second = run(out, metadata={"url": URL, "title": "new"})
+
+    assert site.scrapes == 1
+    assert [it["id"] for it in second] == [it["id"] for it in first]
+    assert [it["text"] for it in second] == ["chunk 0", "chunk 1", "chunk 2"]
+    # metadata always comes from the current row
+    assert all(it["metadata"] == {"url": URL, "title": "new"} for it in second)
+    assert (tmp_path / "chunks.manifest.json").exists()
+
+
+def test_changed_page_is_rescraped(site, tmp_path):
+    out = tmp_path / "chunks.jsonl"
+    run(out)
+    site.validators = {"etag": '"v2"'}
+    site.words = 2
+
+    items = run(out)
+
+    assert site.scrapes == 2
+    assert len(items) == 2
+    site.session.cache.delete.assert_called_once_with(urls=[URL])
+    assert load_manifest(out)["urls"][URL]["etag"] == '"v2"'
+
+
+def test_stale_offsets_are_rescraped(site, tmp_path):
+    out = tmp_path / "chunks.jsonl"
+    run(out)
+    # the output was rewritten by something else, so the recorded offsets no longer line up
+    out.write_bytes(b"\n" + out.read_bytes())
+
+    items = run(out)
+
+    assert site.scrapes == 2
+    assert len(items) == 3
+
+
+def test_missing_output_is_rescraped(site, tmp_path):
+    out = tmp_path / "chunks.jsonl"
+    run(out)
+    manifest = load_manifest(out)
+    out.unlink()
+
+    assert load_manifest(out) == {}
+    items, entry = process_url_incremental(URL, 250, 50, {"url": URL}, manifest, out)
+
+    assert site.scrapes == 2
+    assert len(items) == 3
+    assert entry["chunk_ids"] == [it["id"] for it in items]
+
+
+def test_no_validators_skips_manifest(site, tmp_path):
+    site.validators = {}
+
+    items, entry = process_url_incremental(URL, 250, 50, {"url": URL}, {}, tmp_path / "chunks.jsonl")
+
+    assert entry is None
+    assert len(items) == 3